@@ -1,19 +1,26 @@
 # File: app.py
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List, Optional
+from fastapi.responses import Response, StreamingResponse, JSONResponse, ORJSONResponse
+from sqlalchemy import func, select
+from typing import List, Optional, Dict
 import uvicorn
 from datetime import datetime
 import os
 from dotenv import load_dotenv
 
-from database import SessionLocal, engine, Base
-from models import Lead as LeadModel, Event as EventModel
-from schemas import Lead, LeadResponse, EventData, EventResponse
+from database import SessionLocal, engine, Base, json_dumps
+from models import Lead as LeadModel, LeadEnhancementCache as EnhancementCacheModel
+from schemas import Lead, EventData, EventResponse
+from scoring import score_leads
 import csv
+import re
 import asyncio
+import threading
+import itertools
+import orjson
+import aiosqlite
+from cachetools import TTLCache
 
 # Load environment variables
 load_dotenv()
@@ -29,7 +36,22 @@ except ImportError:
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="Lead Qualification API", version="1.0.0")
+class ORJSONFallbackResponse(ORJSONResponse):
+    """
+    ORJSONResponse that falls back to the stdlib encoder for content orjson rejects
+    (e.g. integers wider than 64 bits in free-form event data)
+    """
+    def render(self, content) -> bytes:
+        try:
+            return super().render(content)
+        except orjson.JSONEncodeError:
+            return JSONResponse.render(self, content)
+
+app = FastAPI(
+    title="Lead Qualification API",
+    version="1.0.0",
+    default_response_class=ORJSONFallbackResponse
+)
 
 # CORS middleware - Permissive for debugging
 app.add_middleware(
@@ -40,82 +62,198 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Dependency to get database session
-def get_db():
-    db = SessionLocal()
+# Events are queued on the request path and bulk inserted by a background task
+# over its own aiosqlite connection, so writes never block the event loop. The queue
+# is created by start_event_writer so it belongs to the loop the app is running on.
+EVENT_BATCH_SIZE = 100
+EVENT_FLUSH_INTERVAL = 0.05  # seconds
+EVENT_INSERT_SQL = "INSERT INTO events (action, data, timestamp) VALUES (?, ?, ?)"
+event_queue: Optional[asyncio.Queue] = None
+event_writer_task: Optional[asyncio.Task] = None
+
+def event_row(action: str, data, timestamp: datetime) -> tuple:
+    """
+    Build an events insert row in the same format SQLAlchemy uses for the JSON and
+    DateTime columns. Called on the request path so a bad payload fails that request only.
+    """
+    return (action, json_dumps(data), timestamp.replace(tzinfo=None).isoformat(" ", "microseconds"))
+
+async def write_events(conn: aiosqlite.Connection, batch: List[tuple]):
+    """
+    Insert a batch of event rows in a single transaction; if the batch fails,
+    retry the rows one at a time so a single bad row does not drop the rest
+    """
+    try:
+        await conn.executemany(EVENT_INSERT_SQL, batch)
+        await conn.commit()
+        return
+    except Exception as e:
+        await conn.rollback()
+        print(f"Batch event insert failed, retrying rows individually: {e}")
+    
+    for row in batch:
+        try:
+            await conn.execute(EVENT_INSERT_SQL, row)
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            print(f"Dropping event {row[0]!r}: {e}")
+
+async def drain_events(conn: aiosqlite.Connection):
+    """
+    Collect queued events into batches of up to EVENT_BATCH_SIZE, flushing at least
+    every EVENT_FLUSH_INTERVAL seconds. A None item flushes the current batch, closes
+    the connection and stops.
+    """
+    loop = asyncio.get_running_loop()
+    stopping = False
     try:
-        yield db
+        while not stopping:
+            item = await event_queue.get()
+            if item is None:
+                break
+            
+            batch = [item]
+            deadline = loop.time() + EVENT_FLUSH_INTERVAL
+            while len(batch) < EVENT_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(event_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            try:
+                await write_events(conn, batch)
+            except Exception as e:
+                print(f"Error writing events: {e}")
     finally:
-        db.close()
+        await conn.close()
+
+# LLM enhancements are cached per (industry, size bucket, source); leads in the same
+# bucket reuse the stored result with their own name and company substituted in.
+# The per-bucket locks are recreated by load_sample_data for each startup loop.
+ENHANCEMENT_SIZE_BUCKET = 50
+enhancement_locks: Dict[str, asyncio.Lock] = {}
+
+def enhancement_cache_key(industry: str, size: int, source: str) -> str:
+    return f"{industry}|{size // ENHANCEMENT_SIZE_BUCKET}|{source}"
+
+def get_cached_enhancement(key: str, name: str, company: str, size: int) -> Optional[dict]:
+    """
+    Look up a cached enhancement and personalize its summary for this lead
+    """
+    cache_table = EnhancementCacheModel.__table__
+    with engine.connect() as conn:
+        row = conn.execute(
+            select(cache_table.c.quality, cache_table.c.summary).where(cache_table.c.key == key)
+        ).first()
+    
+    if row is None:
+        return None
+    
+    summary = row.summary.replace("{name}", name).replace("{company}", company).replace("{size}", str(size))
+    return {"quality": row.quality, "summary": summary}
+
+def cache_enhancement(key: str, enhancement: dict, name: str, company: str, size: int):
+    """
+    Store an enhancement with the lead's name, company and size replaced by placeholders
+    """
+    summary = re.sub(rf"\b{size}\b", "{size}", enhancement["summary"])
+    if company:
+        summary = summary.replace(company, "{company}")
+    if name:
+        summary = summary.replace(name, "{name}")
+    with engine.begin() as conn:
+        conn.execute(
+            EnhancementCacheModel.__table__.insert().prefix_with("OR IGNORE"),
+            {"key": key, "quality": enhancement["quality"], "summary": summary}
+        )
+
+async def request_llm_enhancement(name: str, company: str, industry: str, size: int, source: str) -> dict:
+    """
+    Ask the LLM for a quality rating and summary of a single lead
+    """
+    prompt = f"""
+    Analyze this sales lead and determine its quality and provide a brief summary:
+    
+    Contact: {name}
+    Company: {company}
+    Industry: {industry}
+    Company Size: {size} employees
+    Lead Source: {source}
+    
+    Based on this information:
+    1. Assign a quality rating: "High", "Medium", or "Low"
+    2. Provide a brief summary (max 100 words)
+    
+    Consider:
+    - Larger companies (350+ employees) are typically higher quality
+    - Referrals and trade show leads are usually higher quality
+    - Technology and Healthcare industries often have higher budgets
+    - Organic and email sources can vary in quality
+    
+    Respond in this exact JSON format:
+    {{"quality": "High/Medium/Low", "summary": "Brief summary here"}}
+    """
+    
+    # Run the blocking client call in a worker thread so concurrent enhancements overlap
+    response = await asyncio.to_thread(
+        openai.chat.completions.create,
+        model="gpt-3.5-turbo",
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=150,
+        temperature=0.3
+    )
+    
+    result = orjson.loads(response.choices[0].message.content.strip())
+    print(f"LLM response: {result}")
+    return result
+
+def rule_based_summary(company: str, industry: str, size: int, source: str) -> str:
+    """
+    Summary used when the LLM is not available or fails
+    """
+    return f"Lead from {company} in {industry} industry with {size} employees. Source: {source}."
 
 async def enhance_lead_with_llm(name: str, company: str, industry: str, size: int, source: str) -> dict:
     """
     Use LLM to determine lead quality and generate summary based on lead data
     """
-    if not LLM_AVAILABLE:
-        # Default quality logic when LLM is not available
-        if size >= 500 and source in ["Referral", "Trade Show"]:
-            quality = "High"
-        elif size >= 100 and source not in ["Organic"]:
-            quality = "Medium"
-        else:
-            quality = "Low"
-        
-        summary = f"Lead from {company} in {industry} industry with {size} employees. Source: {source}."
-        return {"quality": quality, "summary": summary}
-    
     try:
-        prompt = f"""
-        Analyze this sales lead and determine its quality and provide a brief summary:
-        
-        Contact: {name}
-        Company: {company}
-        Industry: {industry}
-        Company Size: {size} employees
-        Lead Source: {source}
-        
-        Based on this information:
-        1. Assign a quality rating: "High", "Medium", or "Low"
-        2. Provide a brief summary (max 100 words)
-        
-        Consider:
-        - Larger companies (350+ employees) are typically higher quality
-        - Referrals and trade show leads are usually higher quality
-        - Technology and Healthcare industries often have higher budgets
-        - Organic and email sources can vary in quality
+        cache_key = enhancement_cache_key(industry, size, source)
         
-        Respond in this exact JSON format:
-        {{"quality": "High/Medium/Low", "summary": "Brief summary here"}}
-        """
-        
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=150,
-            temperature=0.3
-        )
-        
-        import json
-        result = json.loads(response.choices[0].message.content.strip())
-        print(f"LLM response: {result}")
-        return result
+        # Serialize leads sharing a bucket so only the first one pays for the API call
+        async with enhancement_locks.setdefault(cache_key, asyncio.Lock()):
+            cached = await asyncio.to_thread(get_cached_enhancement, cache_key, name, company, size)
+            if cached is not None:
+                return cached
+            
+            result = await request_llm_enhancement(name, company, industry, size, source)
+            await asyncio.to_thread(cache_enhancement, cache_key, result, name, company, size)
+            return result
     
     except Exception as e:
         print(f"LLM enhancement failed: {e}")
         # Fallback to rule-based logic
-        if size >= 500 and source in ["Referral", "Trade Show"]:
-            quality = "High"
-        elif size >= 100 and source not in ["Organic"]:
-            quality = "Medium"
-        else:
-            quality = "Low"
-        
-        summary = f"Lead from {company} in {industry} industry with {size} employees. Source: {source}."
-        return {"quality": quality, "summary": summary}
+        return {
+            "quality": score_leads([size], [source])[0],
+            "summary": rule_based_summary(company, industry, size, source)
+        }
+
+# Maximum number of concurrent LLM enhancement requests
+LLM_CONCURRENCY = 8
 
 # Load sample data on startup with LLM enhancement
 @app.on_event("startup")
 async def load_sample_data():
+    global enhancement_locks
+    enhancement_locks = {}
     db = SessionLocal()
     try:
         # Check if data already exists
@@ -128,42 +266,59 @@ async def load_sample_data():
         if os.path.exists(csv_path):
             print("Loading and enhancing leads with LLM...")
             with open(csv_path, 'r', encoding='utf-8') as file:
-                csv_reader = csv.DictReader(file)
-                for row in csv_reader:
-                    # Parse datetime string
-                    created_at_str = row['created_at'].replace('Z', '+00:00')
-                    try:
-                        created_at = datetime.fromisoformat(created_at_str)
-                    except:
-                        created_at = datetime.now()
-                    
-                    # Get LLM enhancement for quality and summary
-                    enhancement = await enhance_lead_with_llm(
-                        name=row['name'],
-                        company=row['company'],
-                        industry=row['industry'],
-                        size=int(row['size']),
-                        source=row['source']
-                    )
-                    
-                    lead = LeadModel(
-                        id=int(row['id']),
-                        name=row['name'],
-                        company=row['company'],
-                        industry=row['industry'],
-                        size=int(row['size']),
-                        source=row['source'],
-                        created_at=created_at,
-                        quality=enhancement['quality'],
-                        summary=enhancement['summary']
-                    )
-                    db.add(lead)
-                    
-                    # Add a small delay to avoid rate limiting
-                    if LLM_AVAILABLE:
-                        await asyncio.sleep(0.5)
+                rows = list(csv.DictReader(file))
             
-            db.commit()
+            if LLM_AVAILABLE:
+                # Enhance all rows concurrently; the semaphore bounds in-flight LLM requests
+                semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+                
+                async def enhance_row(row: dict) -> dict:
+                    async with semaphore:
+                        return await enhance_lead_with_llm(
+                            name=row['name'],
+                            company=row['company'],
+                            industry=row['industry'],
+                            size=int(row['size']),
+                            source=row['source']
+                        )
+                
+                enhancements = await asyncio.gather(*(enhance_row(row) for row in rows))
+            else:
+                # Score the whole CSV in one batch with the rule-based kernel
+                qualities = score_leads([int(row['size']) for row in rows], [row['source'] for row in rows])
+                enhancements = [
+                    {
+                        "quality": quality,
+                        "summary": rule_based_summary(row['company'], row['industry'], int(row['size']), row['source'])
+                    }
+                    for row, quality in zip(rows, qualities)
+                ]
+            
+            records = []
+            for row, enhancement in zip(rows, enhancements):
+                # Parse datetime string
+                created_at_str = row['created_at'].replace('Z', '+00:00')
+                try:
+                    created_at = datetime.fromisoformat(created_at_str)
+                except:
+                    created_at = datetime.now()
+                
+                records.append({
+                    "id": int(row['id']),
+                    "name": row['name'],
+                    "company": row['company'],
+                    "industry": row['industry'],
+                    "size": int(row['size']),
+                    "source": row['source'],
+                    "created_at": created_at,
+                    "quality": enhancement['quality'],
+                    "summary": enhancement['summary']
+                })
+            
+            # One Core executemany in a single transaction; OR IGNORE makes reruns skip existing ids
+            with engine.begin() as conn:
+                conn.execute(LeadModel.__table__.insert().prefix_with("OR IGNORE"), records)
+            invalidate_leads_cache()
             print("Sample data loaded and enhanced successfully")
         else:
             print(f"CSV file not found at {csv_path}")
@@ -173,30 +328,120 @@ async def load_sample_data():
     finally:
         db.close()
 
+@app.on_event("startup")
+async def start_event_writer():
+    global event_queue, event_writer_task
+    event_queue = asyncio.Queue()
+    conn = await aiosqlite.connect(engine.url.database)
+    await conn.execute("PRAGMA synchronous=NORMAL")
+    event_writer_task = asyncio.create_task(drain_events(conn))
+
+@app.on_event("shutdown")
+async def stop_event_writer():
+    # Flush anything still queued before exiting
+    if event_writer_task:
+        event_queue.put_nowait(None)
+        await event_writer_task
+
+# Rows fetched per round trip when streaming leads
+LEADS_STREAM_BATCH = 1000
+
+# Serialized /api/leads responses keyed by (industry, size) filter, bounded by total
+# body size; responses larger than LEADS_CACHE_ENTRY_MAX_BYTES are streamed but not cached
+LEADS_CACHE_MAX_BYTES = 64 * 1024 * 1024
+LEADS_CACHE_ENTRY_MAX_BYTES = 4 * 1024 * 1024
+LEADS_CACHE = TTLCache(maxsize=LEADS_CACHE_MAX_BYTES, ttl=60, getsizeof=len)
+leads_cache_lock = threading.Lock()
+leads_cache_generation = 0
+
+def invalidate_leads_cache():
+    """
+    Drop all cached lead responses; call whenever leads are written
+    """
+    global leads_cache_generation
+    with leads_cache_lock:
+        LEADS_CACHE.clear()
+        leads_cache_generation += 1
+
+def lead_row_to_dict(row) -> dict:
+    """
+    Serialize a lead row into the LeadResponse shape without ORM or Pydantic
+    """
+    return {
+        "id": str(row[0]),
+        "name": row[1],
+        "company": row[2],
+        "industry": row[3],
+        "size": row[4],
+        "source": row[5],
+        "created_at": row[6].isoformat(),
+        "quality": row[7],
+        "summary": row[8]
+    }
+
+def open_leads_stream(stmt) -> tuple:
+    """
+    Run the leads query and fetch its first partition up front, so query errors
+    surface before any response headers are sent
+    """
+    generation = leads_cache_generation
+    conn = engine.connect()
+    try:
+        partitions = conn.execution_options(yield_per=LEADS_STREAM_BATCH).execute(stmt).partitions()
+        first_rows = next(partitions, [])
+    except Exception:
+        conn.close()
+        raise
+    return conn, itertools.chain([first_rows], partitions), generation
+
+def stream_leads(conn, partitions, generation: int, cache_key: tuple):
+    """
+    Yield the selected leads as a JSON array, one partition of rows at a time,
+    and cache the complete body under cache_key once fully sent if it is small enough
+    """
+    chunks = [b"["]
+    cached_bytes = 1
+    try:
+        yield b"["
+        separator = b""
+        for rows in partitions:
+            if not rows:
+                continue
+            chunk = separator + b",".join(orjson.dumps(lead_row_to_dict(row)) for row in rows)
+            if chunks is not None:
+                cached_bytes += len(chunk)
+                # Too large to cache: stop holding on to the body and just stream the rest
+                if cached_bytes < LEADS_CACHE_ENTRY_MAX_BYTES:
+                    chunks.append(chunk)
+                else:
+                    chunks = None
+            yield chunk
+            separator = b","
+    finally:
+        conn.close()
+    yield b"]"
+    
+    if chunks is None:
+        return
+    chunks.append(b"]")
+    with leads_cache_lock:
+        # Skip caching if leads were written while this response was streaming
+        if generation == leads_cache_generation:
+            LEADS_CACHE[cache_key] = b"".join(chunks)
+
 @app.get("/")
 async def root():
     return {"message": "Lead Qualification API is running"}
 
-@app.get("/api/leads", response_model=List[LeadResponse])
+@app.get("/api/leads", response_class=StreamingResponse)
 async def get_leads(
     industry: Optional[str] = Query(None, description="Filter by industry"),
-    size: Optional[int] = Query(None, description="Filter by company size"),
-    db: Session = Depends(get_db)
+    size: Optional[int] = Query(None, le=2**63 - 1, description="Filter by company size")
 ):
     """
     Get leads with optional filtering by industry and size
     """
     try:
-        query = db.query(LeadModel)
-        
-        if industry:
-            query = query.filter(LeadModel.industry.ilike(f"%{industry}%"))
-        
-        if size:
-            query = query.filter(LeadModel.size >= size)
-        
-        leads = query.all()
-        
         # Log the filter event for analytics
         filter_data = {}
         if industry:
@@ -204,41 +449,48 @@ async def get_leads(
         if size:
             filter_data['size'] = size
         
-        event = EventModel(
-            action="filter",
-            data=filter_data if filter_data else None,
-            timestamp=datetime.now()
+        event_queue.put_nowait(event_row("filter", filter_data if filter_data else None, datetime.now()))
+        
+        cache_key = (industry, size)
+        with leads_cache_lock:
+            cached = LEADS_CACHE.get(cache_key)
+        if cached is not None:
+            return Response(content=cached, media_type="application/json")
+        
+        leads_table = LeadModel.__table__
+        stmt = select(
+            leads_table.c.id,
+            leads_table.c.name,
+            leads_table.c.company,
+            leads_table.c.industry,
+            leads_table.c.size,
+            leads_table.c.source,
+            leads_table.c.created_at,
+            leads_table.c.quality,
+            leads_table.c.summary
         )
-        db.add(event)
-        db.commit()
         
-        # Convert to response format
-        response_leads = []
-        for lead in leads:
-            response_leads.append(LeadResponse(
-                id=str(lead.id),
-                name=lead.name,
-                company=lead.company,
-                industry=lead.industry,
-                size=lead.size,
-                source=lead.source,
-                created_at=lead.created_at.isoformat(),
-                quality=lead.quality,
-                summary=lead.summary
-            ))
+        if industry:
+            stmt = stmt.where(leads_table.c.industry.ilike(f"%{industry}%"))
+        
+        if size:
+            stmt = stmt.where(leads_table.c.size >= size)
         
-        return response_leads
+        # Stream rows out as they are fetched instead of buffering the whole result; the
+        # query itself runs here so its errors still become a 500 below
+        conn, partitions, generation = await asyncio.to_thread(open_leads_stream, stmt)
+        return StreamingResponse(
+            stream_leads(conn, partitions, generation, cache_key),
+            media_type="application/json"
+        )
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching leads: {str(e)}")
 
-@app.post("/api/events", response_model=EventResponse)
-async def post_event(
-    event_data: EventData,
-    db: Session = Depends(get_db)
-):
+@app.post("/api/events", response_model=EventResponse, status_code=202)
+async def post_event(event_data: EventData):
     """
-    Log a user interaction event for analytics
+    Queue a user interaction event for analytics; it is written by the batch writer
     """
     try:
         # Parse timestamp if provided, otherwise use current time
@@ -250,25 +502,15 @@ async def post_event(
         else:
             timestamp = datetime.now()
         
-        event = EventModel(
-            action=event_data.action,
-            data=event_data.data,
-            timestamp=timestamp
-        )
-        
-        db.add(event)
-        db.commit()
-        db.refresh(event)
+        event_queue.put_nowait(event_row(event_data.action, event_data.data, timestamp))
         
         return EventResponse(
-            id=event.id,
-            action=event.action,
-            data=event.data,
-            timestamp=event.timestamp.isoformat()
+            action=event_data.action,
+            data=event_data.data,
+            timestamp=timestamp.isoformat()
         )
     
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Error logging event: {str(e)}")
 
 if __name__ == "__main__":
@@ -1,25 +1,121 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, DDL
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
+from contextlib import contextmanager
 import os
+import json
+import orjson
 
 # Database URL - SQLite database will be created in the project root
 SQLALCHEMY_DATABASE_URL = "sqlite:///./lead_qualification.db"
 
+def json_dumps(obj) -> str:
+    """
+    Serialize with orjson, falling back to the stdlib for values orjson rejects
+    (e.g. integers wider than 64 bits)
+    """
+    try:
+        return orjson.dumps(obj).decode()
+    except orjson.JSONEncodeError:
+        return json.dumps(obj)
+
 # Create SQLite engine
 # connect_args={"check_same_thread": False} is needed for SQLite
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
+    # orjson for the JSON columns (events.data)
+    json_serializer=json_dumps,
+    json_deserializer=orjson.loads,
+    future=True,
+    query_cache_size=1200,  # SQL compilation cache shared by all sessions
     echo=False  # Set to True for SQL query debugging
 )
 
+# SQLite tuning applied to every new connection: WAL lets readers run alongside the
+# event writer, and a larger page cache/mmap keeps hot index pages in memory
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-65536")  # 64MB
+    cursor.execute("PRAGMA mmap_size=268435456")  # 256MB
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Thread-local session shared by the analytics reports so a run of sequential
+# queries reuses one Session; call SharedSession.remove() when finished
+SharedSession = scoped_session(SessionLocal)
+
+@contextmanager
+def shared_session():
+    """
+    Use the thread's SharedSession for one report, ending its read transaction on
+    exit. The session itself stays open so the next report reuses it.
+    """
+    db = SharedSession()
+    try:
+        yield db
+    finally:
+        db.rollback()
+
 # Create Base class for declarative models
 Base = declarative_base()
 
+# create_all skips tables that already exist, so create any of their declared indexes
+# that are missing (e.g. ones added to a model after the database was created)
+@event.listens_for(Base.metadata, "after_create")
+def create_missing_indexes(target, connection, **kw):
+    existing = {
+        name for (name,) in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")
+    }
+    for table in target.sorted_tables:
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+
+# Partial expression index backing the filter-event industry aggregation.
+# Attached to the metadata so it is also created on databases whose tables already exist.
+event.listen(
+    Base.metadata,
+    "after_create",
+    DDL(
+        "CREATE INDEX IF NOT EXISTS ix_events_filter_industry "
+        "ON events(json_extract(data, '$.industry')) WHERE action = 'filter'"
+    )
+)
+
+# Backfill the hourly events rollup from existing rows the first time it is created,
+# then keep it current with a trigger on every insert into events
+event.listen(
+    Base.metadata,
+    "after_create",
+    DDL(
+        "INSERT INTO event_daily_stats (date, hour, action, count) "
+        "SELECT date(timestamp), strftime('%%H', timestamp), action, COUNT(*) "
+        "FROM events "
+        "WHERE NOT EXISTS (SELECT 1 FROM event_daily_stats) "
+        "GROUP BY 1, 2, 3"
+    )
+)
+event.listen(
+    Base.metadata,
+    "after_create",
+    DDL(
+        "CREATE TRIGGER IF NOT EXISTS trg_events_daily_stats "
+        "AFTER INSERT ON events "
+        "BEGIN "
+        "INSERT INTO event_daily_stats (date, hour, action, count) "
+        "VALUES (date(NEW.timestamp), strftime('%%H', NEW.timestamp), NEW.action, 1) "
+        "ON CONFLICT(date, hour, action) DO UPDATE SET count = count + 1; "
+        "END"
+    )
+)
+
 # Dependency to get database session
 def get_database():
     db = SessionLocal()
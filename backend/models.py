@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, Index
 from sqlalchemy.sql import func
 from database import Base
 import json
@@ -16,6 +16,11 @@ class Lead(Base):
     quality = Column(String(50), nullable=False, default="Medium")
     summary = Column(Text, nullable=True)
     
+    __table_args__ = (
+        Index('ix_leads_quality', 'quality'),
+        Index('ix_leads_source_quality', 'source', 'quality'),
+    )
+    
     def __repr__(self):
         return f"<Lead(id={self.id}, name='{self.name}', company='{self.company}')>"
 
@@ -27,5 +32,32 @@ class Event(Base):
     data = Column(JSON, nullable=True)  # Store JSON data
     timestamp = Column(DateTime, nullable=False, default=func.now(), index=True)
     
+    __table_args__ = (
+        Index('ix_events_action_ts', 'action', 'timestamp'),
+    )
+    
+    def __repr__(self):
+        return f"<Event(id={self.id}, action='{self.action}', timestamp='{self.timestamp}')>"
+
+class EventDailyStat(Base):
+    __tablename__ = "event_daily_stats"
+    
+    # Hourly rollup of events, maintained by a trigger on inserts into events
+    date = Column(String(10), primary_key=True)  # YYYY-MM-DD
+    hour = Column(String(2), primary_key=True)  # 00-23
+    action = Column(String(100), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<EventDailyStat(date='{self.date}', hour='{self.hour}', action='{self.action}', count={self.count})>"
+
+class LeadEnhancementCache(Base):
+    __tablename__ = "lead_enhancement_cache"
+    
+    # (industry, size bucket, source) key; summary holds {name}/{company} placeholders
+    key = Column(String(255), primary_key=True)
+    quality = Column(String(50), nullable=False)
+    summary = Column(Text, nullable=False)
+    
     def __repr__(self):
-        return f"<Event(id={self.id}, action='{self.action}', timestamp='{self.timestamp}')>"
\ No newline at end of file
+        return f"<LeadEnhancementCache(key='{self.key}', quality='{self.quality}')>"
\ No newline at end of file
@@ -53,7 +53,7 @@ class Event(BaseModel):
 
 class EventResponse(BaseModel):
     """Response model for events"""
-    id: int
+    id: Optional[int] = None  # Not known yet when the event is queued for the batch writer
     action: str
     data: Optional[Dict[str, Any]] = None
     timestamp: str  # ISO string format
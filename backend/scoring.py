@@ -0,0 +1,58 @@
+# File: scoring.py
+"""
+Batch rule-based lead scoring used when the LLM is not available
+"""
+
+from typing import List
+import numpy as np
+
+# Optional Numba JIT for the scoring kernel
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Lead sources as integer codes; anything unlisted maps to "Other"
+SOURCE_CODES = {"Referral": 0, "Trade Show": 1, "Organic": 2, "Email": 3}
+OTHER_SOURCE_CODE = 4
+
+# Score codes 0/1/2 decode to these quality labels
+QUALITY_LABELS = ("Low", "Medium", "High")
+
+def _score_numpy(sizes: np.ndarray, src_codes: np.ndarray) -> np.ndarray:
+    high = (sizes >= 500) & ((src_codes == 0) | (src_codes == 1))
+    medium = (sizes >= 100) & (src_codes != 2)
+    return np.where(high, 2, np.where(medium, 1, 0)).astype(np.int8)
+
+if NUMBA_AVAILABLE:
+    # Compiled serially: parallel=True starts a threading layer that can hang interpreter
+    # exit when first launched off the main thread (as under the FastAPI event loop)
+    @njit(cache=True)
+    def _score_kernel(sizes, src_codes, out):
+        for i in range(len(sizes)):
+            if sizes[i] >= 500 and (src_codes[i] == 0 or src_codes[i] == 1):
+                out[i] = 2
+            elif sizes[i] >= 100 and src_codes[i] != 2:
+                out[i] = 1
+            else:
+                out[i] = 0
+
+def score_leads(sizes: List[int], sources: List[str]) -> List[str]:
+    """
+    Apply the rule-based quality logic to a whole batch of leads at once
+    """
+    size_array = np.asarray(sizes, dtype=np.int64)
+    src_codes = np.fromiter(
+        (SOURCE_CODES.get(source, OTHER_SOURCE_CODE) for source in sources),
+        dtype=np.int8,
+        count=len(sources)
+    )
+
+    if NUMBA_AVAILABLE:
+        scores = np.empty(len(size_array), dtype=np.int8)
+        _score_kernel(size_array, src_codes, scores)
+    else:
+        scores = _score_numpy(size_array, src_codes)
+
+    return [QUALITY_LABELS[score] for score in scores]